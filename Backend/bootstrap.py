@@ -0,0 +1,10 @@
+from dotenv import load_dotenv
+
+_LOADED = False
+
+def init() -> None:
+    """Load environment variables from .env exactly once per process."""
+    global _LOADED
+    if not _LOADED:
+        load_dotenv()
+        _LOADED = True
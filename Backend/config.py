@@ -1,8 +1,10 @@
-from typing import Set
+from typing import FrozenSet
+from functools import lru_cache
 import os
-from dotenv import load_dotenv
+import bootstrap
 
-load_dotenv()
+# No-op when the entrypoint has already loaded .env
+bootstrap.init()
 
 class Config:
     """Centralized configuration for the application."""
@@ -15,25 +17,54 @@ class Config:
     MINIO_SECRET_KEY: str = os.getenv("MINIO_SECRET_KEY", "supersecret")
     MINIO_BUCKET_NAME: str = os.getenv("MINIO_BUCKET", "myfiles")
     MINIO_SECURE: bool = os.getenv("MINIO_SECURE", "False").lower() == "true"
+    MINIO_MAX_CONNECTIONS: int = int(os.getenv("MINIO_MAX_CONNECTIONS", "64"))
     
     # Local storage directory
     LOCAL_STORAGE_PATH: str = "./Uploads"
     
+    # Upload streaming: MinIO part size (larger uploads are sent as multipart) and local storage copy buffer size
+    UPLOAD_PART_SIZE: int = int(os.getenv("UPLOAD_PART_SIZE", str(10 * 1024 * 1024)))
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+    
+    # Read size used when streaming downloads from MinIO
+    DOWNLOAD_CHUNK_SIZE: int = 1024 * 1024
+    
     # Logging level (e.g., DEBUG, INFO, WARNING, ERROR)
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     
     # MongoDB configuration
     MONGODB_URI: str = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
     MONGODB_DATABASE: str = os.getenv("MONGODB_DATABASE", "mydb")
+    MONGODB_MAX_POOL_SIZE: int = int(os.getenv("MONGODB_MAX_POOL_SIZE", "200"))
+    MONGODB_MIN_POOL_SIZE: int = int(os.getenv("MONGODB_MIN_POOL_SIZE", "10"))
+    # Long enough to ride out a replica-set election; health probes are bounded by HEALTH_CHECK_TIMEOUT instead
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS: int = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+    
+    # Number of file metadata lookups cached per process for downloads
+    METADATA_CACHE_SIZE: int = int(os.getenv("METADATA_CACHE_SIZE", "1024"))
     
     # Supported file extensions
-    ALLOWED_EXTENSIONS: Set[str] = {".txt", ".jpg", ".png", ".json"}
+    ALLOWED_EXTENSIONS: FrozenSet[str] = frozenset({".txt", ".jpg", ".png", ".json"})
     
     # Health check status constants
     HEALTHY: str = "healthy"
     UNHEALTHY: str = "unhealthy"
     
+    # Seconds a healthy check result is reused before probing the backends again
+    HEALTH_CACHE_TTL: float = float(os.getenv("HEALTH_CACHE_TTL", "1.5"))
+    # Seconds each backend probe may take before it is reported unhealthy
+    HEALTH_CHECK_TIMEOUT: float = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2.0"))
+    
+    # Server process settings used when running main.py directly
+    WORKERS: int = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+    LIMIT_CONCURRENCY: int = int(os.getenv("LIMIT_CONCURRENCY", "1000"))
+    
     # CORS origin for frontend; default matches README's frontend URL
     CORS_ORIGIN: str = os.getenv("CORS_ORIGIN", "http://localhost:3000")
 
-CONFIG = Config()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_config() -> Config:
+    """Return the process-wide configuration, built on first use."""
+    return Config()
+
+CONFIG = get_config()
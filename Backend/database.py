@@ -1,28 +1,52 @@
 from pymongo import MongoClient
+from pymongo.write_concern import WriteConcern
 from pymongo.errors import ConnectionFailure, OperationFailure
 from bson import ObjectId
-from typing import Dict, List
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
 import logging
 from config import CONFIG
-from tenacity import retry, stop_after_attempt, wait_fixed
 
 logger = logging.getLogger(__name__)
 
+# One thread-safe pooled client per process. connect=False defers monitoring threads and
+# minPoolSize connections to the first operation, so importing this module (e.g. in the
+# uvicorn supervisor process) opens no connections
+_CLIENT = MongoClient(
+    CONFIG.MONGODB_URI,
+    connect=False,
+    maxPoolSize=CONFIG.MONGODB_MAX_POOL_SIZE,
+    minPoolSize=CONFIG.MONGODB_MIN_POOL_SIZE,
+    maxIdleTimeMS=300_000,
+    serverSelectionTimeoutMS=CONFIG.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+    retryWrites=True,
+    retryReads=True,
+    appname="dropbox-clone"
+)
+
 class MongoDBClient:
     """MongoDB client for managing file metadata."""
 
     def __init__(self):
-        """Initialize MongoDB connection using configuration."""
+        """Bind to the shared MongoDB connection pool."""
+        self.client = _CLIENT
+        self.db = self.client[CONFIG.MONGODB_DATABASE]
+        # Metadata is written after the object is stored, so skip waiting on the journal
+        self.collection = self.db.get_collection("files", write_concern=WriteConcern(w=1, j=False))
+        # File metadata is never modified after insert, so ID lookups can be memoized per process
+        self._find_file_by_id_cached = lru_cache(maxsize=CONFIG.METADATA_CACHE_SIZE)(self._find_file_by_id)
+        logger.debug("MongoDB client initialized")
+
+    def ensure_indexes(self) -> None:
+        """Create the indexes backing the newest-first file listing and content-hash lookups."""
         try:
-            self.client = MongoClient(CONFIG.MONGODB_URI)
-            self.db = self.client[CONFIG.MONGODB_DATABASE]
-            self.collection = self.db["files"]
-            logger.info("MongoDB client initialized")
-        except ConnectionFailure as e:
-            logger.error(f"MongoDB connection failed: {str(e)}")
-            raise ValueError(f"MongoDB connection failed: {str(e)}")
+            self.collection.create_index([("upload_date", -1), ("_id", -1)])
+            self.collection.create_index("sha256")
+            logger.info("MongoDB indexes ensured")
+        except (ConnectionFailure, OperationFailure) as e:
+            logger.error(f"Failed to create MongoDB indexes: {str(e)}")
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
     def insert_file(self, file_metadata: Dict) -> str:
         """Insert file metadata and return its ID."""
         try:
@@ -33,25 +57,65 @@ class MongoDBClient:
             logger.error(f"Failed to insert file metadata: {str(e)}")
             raise ValueError(f"Database insert failed: {str(e)}")
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
-    def get_files(self) -> List[Dict]:
-        """Retrieve metadata for all files."""
+    def insert_files(self, file_metadatas: List[Dict]) -> List[str]:
+        """Insert metadata for several files in one round-trip and return their IDs."""
         try:
-            files = list(self.collection.find())
-            logger.debug(f"Retrieved {len(files)} files")
-            return files
+            result = self.collection.insert_many(file_metadatas, ordered=False)
+            logger.debug(f"Inserted {len(result.inserted_ids)} file metadata documents")
+            return [str(inserted_id) for inserted_id in result.inserted_ids]
+        except OperationFailure as e:
+            logger.error(f"Failed to insert file metadata batch: {str(e)}")
+            raise ValueError(f"Database insert failed: {str(e)}")
+
+    def get_files(
+        self,
+        limit: Optional[int] = None,
+        skip: int = 0,
+        before: Optional[datetime] = None,
+        before_id: Optional[str] = None
+    ) -> Iterator[Dict]:
+        """Stream file listing documents (file_id, filename, upload_date), newest first; all of them unless limit is set.
+
+        Paging after the last row of a previous page needs both its upload_date (`before`)
+        and file_id (`before_id`); `before` alone skips files sharing that timestamp.
+        """
+        try:
+            if before and before_id:
+                match = {"$or": [
+                    {"upload_date": {"$lt": before}},
+                    {"upload_date": before, "_id": {"$lt": ObjectId(before_id)}}
+                ]}
+                pipeline = [{"$match": match}]
+            else:
+                pipeline = [{"$match": {"upload_date": {"$lt": before}}}] if before else []
+            pipeline += [
+                # _id breaks upload_date ties so pages neither repeat nor drop files
+                {"$sort": {"upload_date": -1, "_id": -1}},
+                {"$skip": skip},
+                # Shape documents server-side so they match the response schema as-is
+                {"$project": {"_id": 0, "file_id": {"$toString": "$_id"}, "filename": 1, "upload_date": 1}}
+            ]
+            if limit is not None:
+                # Limit before shaping so only the requested page is projected
+                pipeline.insert(-1, {"$limit": limit})
+            yield from self.collection.aggregate(pipeline, batchSize=200)
         except OperationFailure as e:
             logger.error(f"Failed to retrieve files: {str(e)}")
             raise ValueError(f"Database query failed: {str(e)}")
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
-    def get_file_by_id(self, file_id: str) -> Dict:
-        """Retrieve file metadata by ID."""
+    def get_file_by_id(self, file_id: str) -> Optional[Dict]:
+        """Retrieve file metadata by ID, using the in-process lookup cache."""
+        if not ObjectId.is_valid(file_id):
+            return None
+        file = self._find_file_by_id_cached(file_id)
+        if not file:
+            logger.warning(f"File not found: {file_id}")
+        return file
+
+    def _find_file_by_id(self, file_id: str) -> Optional[Dict]:
+        """Query MongoDB for file metadata by ID."""
         try:
-            file = self.collection.find_one({"_id": ObjectId(file_id)})
-            if not file:
-                logger.warning(f"File not found: {file_id}")
-            return file
+            return self.collection.find_one({"_id": ObjectId(file_id)})
         except OperationFailure as e:
             logger.error(f"Failed to retrieve file {file_id}: {str(e)}")
             raise ValueError(f"Database query failed: {str(e)}")
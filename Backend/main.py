@@ -1,7 +1,18 @@
-from fastapi import FastAPI
+import bootstrap
+
+# Load .env before any module reads configuration
+bootstrap.init()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import uvicorn
+from anyio import to_thread
 from routers.files import router as files_router
+from database import MongoDBClient
+from minio.error import S3Error
+from storage import get_storage_client
 import logging
 from config import CONFIG
 
@@ -12,7 +23,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Dropbox Clone Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared clients and prepare backing services before serving requests."""
+    app.state.mongo_client = MongoDBClient()
+    app.state.storage_client = get_storage_client(CONFIG.STORAGE_BACKEND)
+    # Like ensure_indexes, storage setup failures are logged and don't block startup;
+    # /health reports the backend as unhealthy and MinIO retries bucket setup on upload
+    await to_thread.run_sync(app.state.mongo_client.ensure_indexes)
+    try:
+        await to_thread.run_sync(app.state.storage_client.initialize)
+    except Exception as e:
+        logger.error(f"Storage initialization failed, continuing startup: {str(e)}")
+    yield
+
+# Serialize responses with orjson instead of the stdlib json encoder
+app = FastAPI(title="Dropbox Clone Backend", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Enable CORS for frontend, configurable via environment variable
 app.add_middleware(
@@ -23,9 +49,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(S3Error)
+async def s3_error_handler(request: Request, exc: S3Error):
+    """Map MinIO errors raised by storage operations to a 500 response."""
+    logger.error(f"MinIO operation failed for {request.url.path}: {str(exc)}")
+    return ORJSONResponse(status_code=500, content={"detail": f"Storage operation failed: {exc.code}"})
+
+@app.exception_handler(OSError)
+async def os_error_handler(request: Request, exc: OSError):
+    """Map local storage errors to a 500 response."""
+    logger.error(f"Storage I/O failed for {request.url.path}: {str(exc)}")
+    return ORJSONResponse(status_code=500, content={"detail": "Storage operation failed"})
+
 # Include file operation endpoints
 app.include_router(files_router)
 
 if __name__ == "__main__":
     logger.info("Starting FastAPI server")
-    uvicorn.run(app, host="0.0.0.0", port=5001)
\ No newline at end of file
+    # Workers need an import string; each one builds its own client pools
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=5001,
+        workers=CONFIG.WORKERS,
+        # "auto" picks uvloop and httptools when installed and falls back to asyncio/h11 otherwise
+        loop="auto",
+        http="auto",
+        limit_concurrency=CONFIG.LIMIT_CONCURRENCY,
+        log_level=CONFIG.LOG_LEVEL.lower()
+    )
\ No newline at end of file
@@ -1,61 +1,122 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from fastapi.responses import StreamingResponse
-from typing import List
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Request
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from anyio import to_thread
+from typing import Any, Dict, Iterator, List, Optional
+import asyncio
+import io
+import re
+import time
 import uuid
-from storage import StorageClient, get_storage_client
+from minio.error import S3Error
+from storage import StorageClient, LocalStorageClient
 from database import MongoDBClient
 from schemas import FileUploadResponse, FileMetadata, HealthResponse
-from datetime import datetime
+from datetime import datetime, timezone
 from config import CONFIG
-from tenacity import retry, stop_after_attempt, wait_fixed
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api", tags=["files"])
 
-# Dependency injection for clients
-def get_mongo_client():
-    return MongoDBClient()
+# ObjectId format check compiled once instead of importing bson per request
+_OID_RE = re.compile(r"[0-9a-fA-F]{24}").fullmatch
 
-def get_storage_client_dep():
-    return get_storage_client(CONFIG.STORAGE_BACKEND)
+# Allowed extensions without the leading dot, matched against str.rpartition output
+_ALLOWED_EXTS = frozenset(ext.lower().lstrip(".") for ext in CONFIG.ALLOWED_EXTENSIONS)
 
-@router.post("/upload", response_model=FileUploadResponse)
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
-async def upload_file(file: UploadFile = File(...), storage_client: StorageClient = Depends(get_storage_client_dep), mongo_client: MongoDBClient = Depends(get_mongo_client)):
-    """Upload a file to storage and save metadata in MongoDB."""
-    logger.info(f"Received upload request for file: {file.filename}")
-    
-    # Validate file and extension
+# Last healthy check result plus the probe currently in flight, shared by concurrent requests
+_health_cache: Dict[str, Any] = {"expires_at": float("-inf"), "response": None, "inflight": None}
+
+# Dependency injection for clients; the app lifespan creates them once on app.state
+async def get_mongo_client(request: Request) -> MongoDBClient:
+    return request.app.state.mongo_client
+
+async def get_storage_client_dep(request: Request) -> StorageClient:
+    return request.app.state.storage_client
+
+def _validate_upload(file: UploadFile) -> int:
+    """Reject uploads without a filename, with an unsupported extension or with no content; return the size."""
     if not file.filename:
         logger.warning("Upload attempted with no file")
         raise HTTPException(status_code=400, detail="No file provided")
-    if not any(file.filename.lower().endswith(ext) for ext in CONFIG.ALLOWED_EXTENSIONS):
+    # Lowercase only the extension and check it with a single set lookup; names without a dot have no extension
+    _, sep, ext = file.filename.rpartition(".")
+    if not sep or ext.lower() not in _ALLOWED_EXTS:
         logger.warning(f"Unsupported file type: {file.filename}")
-        raise HTTPException(status_code=400, detail=f"Unsupported file type. Allowed: {', '.join(CONFIG.ALLOWED_EXTENSIONS)}")
+        raise HTTPException(status_code=400, detail=f"Unsupported file type. Allowed: {', '.join(sorted(CONFIG.ALLOWED_EXTENSIONS))}")
+    file_size = file.size
+    if file_size is None:
+        # No size on the multipart part: measure the spooled file by seeking to its end
+        file.file.seek(0, io.SEEK_END)
+        file_size = file.file.tell()
+        file.file.seek(0)
+    if file_size == 0:
+        logger.warning(f"Empty file uploaded: {file.filename}")
+        raise HTTPException(status_code=400, detail="File is empty")
+    return file_size
+
+async def _store_upload(file: UploadFile, file_size: int, storage_client: StorageClient) -> Dict:
+    """Stream a validated upload to storage and return its metadata document."""
+    # Two-hex-digit prefix spreads objects over 256 key prefixes; the client filename
+    # stays out of the key (it is kept in Mongo) so it can't steer the storage path
+    object_hex = uuid.uuid4().hex
+    object_name = f"{object_hex[:2]}/{object_hex}"
+    # Stream the spooled upload straight to storage instead of reading it into memory
+    file_size, sha256 = await to_thread.run_sync(storage_client.upload_file, object_name, file.file, file.content_type, file_size)
+    return {
+        "filename": file.filename,
+        "size": file_size,
+        "sha256": sha256,
+        "content_type": file.content_type,
+        "upload_date": datetime.now(timezone.utc),
+        "object_name": object_name
+    }
+
+def _discard_objects(storage_client: StorageClient, object_names: List[str]) -> None:
+    """Best-effort removal of stored objects whose batch failed; errors are logged, not raised."""
+    for object_name in object_names:
+        try:
+            storage_client.delete_file(object_name)
+        except Exception as e:
+            logger.error(f"Failed to remove orphaned object {object_name}: {str(e)}")
+
+def _strip_weak(tag: str) -> str:
+    """Return an entity tag without surrounding whitespace or its W/ weakness prefix."""
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def _local_file_path(storage_client: LocalStorageClient, object_name: str) -> str:
+    """Return the path of a stored local file, raising FileNotFoundError if it is missing."""
+    if not storage_client.file_exists(object_name):
+        raise FileNotFoundError(object_name)
+    return storage_client.get_path(object_name)
+
+def _iter_stream(response: Any, chunk_size: int) -> Iterator[bytes]:
+    """Yield a MinIO object response in large chunks and release its connection once done."""
+    try:
+        yield from response.stream(chunk_size)
+    finally:
+        response.close()
+        response.release_conn()
+
+@router.post("/upload", response_model=FileUploadResponse)
+async def upload_file(file: UploadFile = File(...), storage_client: StorageClient = Depends(get_storage_client_dep), mongo_client: MongoDBClient = Depends(get_mongo_client)):
+    """Upload a file to storage and save metadata in MongoDB."""
+    logger.info(f"Received upload request for file: {file.filename}")
+    file_size = _validate_upload(file)
     
     try:
-        object_name = f"{uuid.uuid4()}{file.filename}"
-        file_content = await file.read()
-        if len(file_content) == 0:
-            logger.warning(f"Empty file uploaded: {file.filename}")
-            raise HTTPException(status_code=400, detail="File is empty")
-        
-        file_size = len(file_content)
-        storage_client.upload_file(object_name, file_content, file.content_type)
-        
-        file_metadata = {
-            "filename": file.filename,
-            "size": file_size,
-            "content_type": file.content_type,
-            "upload_date": datetime.utcnow(),
-            "object_name": object_name
-        }
-        file_id = mongo_client.insert_file(file_metadata)
+        file_metadata = await _store_upload(file, file_size, storage_client)
+        file_id = await to_thread.run_sync(mongo_client.insert_file, file_metadata)
         
         logger.info(f"File uploaded successfully: {file.filename}, ID: {file_id}")
-        return FileUploadResponse(file_id=file_id, filename=file.filename, size=file_size)
+        return FileUploadResponse(file_id=file_id, filename=file.filename, size=file_metadata["size"])
+    except HTTPException:
+        raise
+    except (S3Error, OSError):
+        # Storage errors are translated by the app-level exception handlers
+        raise
     except ValueError as e:
         logger.error(f"File upload failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
@@ -63,20 +124,64 @@ async def upload_file(file: UploadFile = File(...), storage_client: StorageClien
         logger.error(f"Unexpected file upload error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@router.get("/files", response_model=List[FileMetadata])
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
-async def list_files(mongo_client: MongoDBClient = Depends(get_mongo_client)):
-    """Retrieve metadata for all files."""
-    logger.info("Listing all files")
+@router.post("/upload_batch", response_model=List[FileUploadResponse])
+async def upload_files(files: List[UploadFile] = File(...), storage_client: StorageClient = Depends(get_storage_client_dep), mongo_client: MongoDBClient = Depends(get_mongo_client)):
+    """Upload several files concurrently and save their metadata in one MongoDB round-trip."""
+    logger.info(f"Received batch upload request for {len(files)} files")
+    # Validate every file before any storage work starts, so a bad file can't leave siblings half-stored
+    file_sizes = [_validate_upload(file) for file in files]
+    
     try:
-        files = mongo_client.get_files()
+        # Wait for every store to finish, even after one fails, so no thread is still reading an upload
+        # that FastAPI closes once we respond
+        results = await asyncio.gather(*(
+            _store_upload(file, file_size, storage_client) for file, file_size in zip(files, file_sizes)
+        ), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # Remove what did get stored so a failed batch leaves no objects without metadata
+            stored = [result["object_name"] for result in results if not isinstance(result, BaseException)]
+            await to_thread.run_sync(_discard_objects, storage_client, stored)
+            raise errors[0]
+        file_metadatas = results
+        file_ids = await to_thread.run_sync(mongo_client.insert_files, file_metadatas)
+        
+        logger.info(f"Batch upload succeeded: {len(file_ids)} files")
         return [
-            FileMetadata(
-                file_id=str(f["_id"]),
-                filename=f["filename"],
-                upload_date=f["upload_date"]
-            ) for f in files
+            FileUploadResponse(file_id=file_id, filename=metadata["filename"], size=metadata["size"])
+            for file_id, metadata in zip(file_ids, file_metadatas)
         ]
+    except HTTPException:
+        raise
+    except (S3Error, OSError):
+        # Storage errors are translated by the app-level exception handlers
+        raise
+    except ValueError as e:
+        logger.error(f"Batch upload failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Batch upload failed: {str(e)}")
+    except Exception as e:
+        logger.error(f"Unexpected batch upload error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/files", response_model=List[FileMetadata])
+async def list_files(
+    # No default page size: the frontend lists every file and does not page yet
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    skip: int = Query(0, ge=0),
+    before: Optional[datetime] = None,
+    before_id: Optional[str] = None,
+    mongo_client: MongoDBClient = Depends(get_mongo_client)
+):
+    """Retrieve file metadata newest first, optionally one page at a time."""
+    logger.info(f"Listing files (limit={limit}, skip={skip}, before={before}, before_id={before_id})")
+    if before_id is not None and (before is None or not _OID_RE(before_id)):
+        logger.warning(f"Invalid listing cursor: before={before}, before_id={before_id}")
+        raise HTTPException(status_code=400, detail="before_id must be a valid file ID and requires before")
+    try:
+        # Drain the cursor in the worker thread so batch fetches stay off the event loop
+        files = await to_thread.run_sync(lambda: list(mongo_client.get_files(limit, skip, before, before_id)))
+        # Documents already match FileMetadata; returning a Response skips pydantic serialization entirely
+        return ORJSONResponse(files)
     except ValueError as e:
         logger.error(f"List files failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"List files failed: {str(e)}")
@@ -85,34 +190,61 @@ async def list_files(mongo_client: MongoDBClient = Depends(get_mongo_client)):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @router.get("/download/{file_id}")
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
-async def download_file(file_id: str, storage_client: StorageClient = Depends(get_storage_client_dep), mongo_client: MongoDBClient = Depends(get_mongo_client)):
+async def download_file(file_id: str, request: Request, storage_client: StorageClient = Depends(get_storage_client_dep), mongo_client: MongoDBClient = Depends(get_mongo_client)):
     """Download a file by ID from storage."""
     logger.info(f"Download request for file ID: {file_id}")
     # Validate file_id format
-    from bson import ObjectId
-    if not ObjectId.is_valid(file_id):
+    if not _OID_RE(file_id):
         logger.warning(f"Invalid file ID format: {file_id}")
         raise HTTPException(status_code=400, detail="Invalid file ID format")
     
     try:
-        file_metadata = mongo_client.get_file_by_id(file_id)
+        file_metadata = await to_thread.run_sync(mongo_client.get_file_by_id, file_id)
         if not file_metadata:
             logger.warning(f"File not found: {file_id}")
             raise HTTPException(status_code=404, detail="File not found in database")
         
-        # Verify file exists in storage
-        if not storage_client.file_exists(file_metadata["object_name"]):
-            logger.warning(f"File not found in storage: {file_metadata['object_name']}")
-            raise HTTPException(status_code=404, detail="File not found in storage")
+        # Stored files never change, so the file ID is a stable validator for conditional GETs
+        opaque_tag = f'"{file_id}"'
+        cache_headers = {"ETag": f"W/{opaque_tag}", "Cache-Control": "private, max-age=3600"}
+        if_none_match = request.headers.get("if-none-match")
+        # If-None-Match uses weak comparison (RFC 7232), so "<id>" and W/"<id>" both match
+        if if_none_match and (if_none_match.strip() == "*" or opaque_tag in (_strip_weak(tag) for tag in if_none_match.split(","))):
+            logger.info(f"File not modified: {file_metadata['filename']}")
+            return Response(status_code=304, headers=cache_headers)
+        
+        if isinstance(storage_client, LocalStorageClient):
+            # Resolve and stat the file in one worker-thread hop rather than on the event loop
+            file_path = await to_thread.run_sync(_local_file_path, storage_client, file_metadata["object_name"])
+            # FileResponse sends local files with sendfile(2), skipping user-space copies
+            logger.info(f"File downloaded: {file_metadata['filename']}")
+            return FileResponse(
+                file_path,
+                media_type=file_metadata["content_type"],
+                filename=file_metadata["filename"],
+                headers=cache_headers
+            )
         
-        file_stream = storage_client.get_file(file_metadata["object_name"])
+        file_stream, file_size = await to_thread.run_sync(storage_client.get_file, file_metadata["object_name"])
         logger.info(f"File downloaded: {file_metadata['filename']}")
         return StreamingResponse(
-            file_stream,
+            _iter_stream(file_stream, CONFIG.DOWNLOAD_CHUNK_SIZE),
             media_type=file_metadata["content_type"],
-            headers={"Content-Disposition": f'attachment; filename="{file_metadata["filename"]}"'}
+            headers={
+                **cache_headers,
+                "Content-Length": str(file_size),
+                "Content-Disposition": f'attachment; filename="{file_metadata["filename"]}"'
+            }
         )
+    except HTTPException:
+        raise
+    except FileNotFoundError:
+        # MinIO reports missing objects from get_object itself, saving a stat_object round-trip
+        logger.warning(f"File not found in storage: {file_metadata['object_name']}")
+        raise HTTPException(status_code=404, detail="File not found in storage")
+    except (S3Error, OSError):
+        # Storage errors are translated by the app-level exception handlers
+        raise
     except ValueError as e:
         logger.error(f"File download failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"File download failed: {str(e)}")
@@ -120,13 +252,18 @@ async def download_file(file_id: str, storage_client: StorageClient = Depends(ge
         logger.error(f"Unexpected file download error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@router.get("/health", response_model=HealthResponse)
-async def health_check(storage_client: StorageClient = Depends(get_storage_client_dep), mongo_client: MongoDBClient = Depends(get_mongo_client)):
+async def _probe_health(storage_client: StorageClient, mongo_client: MongoDBClient) -> HealthResponse:
     """Check health of MongoDB and storage backend."""
-    logger.info("Health check requested")
     try:
-        mongo_status = mongo_client.check_health()
-        storage_status = storage_client.check_health()
+        # Probe both backends concurrently; a failing or slow probe only marks its own component unhealthy
+        mongo_status, storage_status = [
+            {"status": CONFIG.UNHEALTHY, "error": str(result) or type(result).__name__} if isinstance(result, Exception) else result
+            for result in await asyncio.gather(
+                asyncio.wait_for(to_thread.run_sync(mongo_client.check_health), CONFIG.HEALTH_CHECK_TIMEOUT),
+                asyncio.wait_for(to_thread.run_sync(storage_client.check_health), CONFIG.HEALTH_CHECK_TIMEOUT),
+                return_exceptions=True
+            )
+        ]
         # Combine statuses: overall status is healthy only if both components are healthy
         overall_status = CONFIG.HEALTHY if mongo_status["status"] == CONFIG.HEALTHY and storage_status["status"] == CONFIG.HEALTHY else CONFIG.UNHEALTHY
         logger.debug(f"Health check result: {overall_status}")
@@ -145,4 +282,25 @@ async def health_check(storage_client: StorageClient = Depends(get_storage_clien
                 "mongodb": {"status": CONFIG.UNHEALTHY, "error": str(e)},
                 "storage": {"status": CONFIG.UNHEALTHY, "error": str(e)}
             }
-        )
\ No newline at end of file
+        )
+
+async def _refresh_health(storage_client: StorageClient, mongo_client: MongoDBClient) -> HealthResponse:
+    """Run one health probe and cache it; unhealthy results are not reused."""
+    try:
+        response = await _probe_health(storage_client, mongo_client)
+        ttl = CONFIG.HEALTH_CACHE_TTL if response.status == CONFIG.HEALTHY else 0
+        _health_cache.update(expires_at=time.monotonic() + ttl, response=response)
+        return response
+    finally:
+        _health_cache["inflight"] = None
+
+@router.get("/health", response_model=HealthResponse)
+async def health_check(storage_client: StorageClient = Depends(get_storage_client_dep), mongo_client: MongoDBClient = Depends(get_mongo_client)):
+    """Return backend health, reusing a recent healthy result to absorb frequent probes."""
+    logger.info("Health check requested")
+    if time.monotonic() < _health_cache["expires_at"]:
+        return _health_cache["response"]
+    # Concurrent requests await the same probe; shield it so one disconnecting client can't cancel it
+    if _health_cache["inflight"] is None:
+        _health_cache["inflight"] = asyncio.ensure_future(_refresh_health(storage_client, mongo_client))
+    return await asyncio.shield(_health_cache["inflight"])
@@ -1,76 +1,151 @@
 from minio import Minio
 from minio.error import S3Error
-import io
+import certifi
+import urllib3
+import functools
+import hashlib
 import os
-from typing import Any
+import shutil
+import time
+from typing import Any, BinaryIO, Callable, Optional, Tuple, TypeVar
 from config import CONFIG
-from tenacity import retry, stop_after_attempt, wait_fixed
 import logging
 
 logger = logging.getLogger(__name__)
 
+F = TypeVar("F", bound=Callable[..., Any])
+
+def retry(attempts: int = 3, base_delay: float = 0.1, max_delay: float = 2.0) -> Callable[[F], F]:
+    """Retry a storage call with exponential backoff; missing files and invalid names are reported immediately."""
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            for attempt in range(attempts - 1):
+                try:
+                    return fn(*args, **kwargs)
+                except (FileNotFoundError, ValueError):
+                    raise
+                except Exception as e:
+                    delay = min(base_delay * 2 ** attempt, max_delay)
+                    logger.warning(f"{fn.__qualname__} failed ({str(e)}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class HashingReader:
+    """File-like wrapper that counts and SHA-256 hashes the bytes read through it."""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def read(self, n: int = -1) -> bytes:
+        chunk = self.stream.read(n)
+        self.size += len(chunk)
+        self.sha256.update(chunk)
+        return chunk
+
 class StorageClient:
     """Abstract base class to support multiple storage backends (e.g., MinIO, local filesystem)."""
 
-    def upload_file(self, object_name: str, file_content: bytes, content_type: str) -> None:
+    def upload_file(self, object_name: str, file_stream: BinaryIO, content_type: str, length: Optional[int] = None) -> Tuple[int, str]:
         raise NotImplementedError
 
-    def get_file(self, object_name: str) -> Any:
+    def get_file(self, object_name: str) -> Tuple[Any, int]:
         raise NotImplementedError
 
     def file_exists(self, object_name: str) -> bool:
         raise NotImplementedError
 
+    def delete_file(self, object_name: str) -> None:
+        raise NotImplementedError
+
     def check_health(self) -> dict:
         raise NotImplementedError
 
+    def initialize(self) -> None:
+        """Prepare backend resources once at application startup."""
+
 class MinIOClient(StorageClient):
     """MinIO client for file storage operations."""
 
     def __init__(self):
-        """Initialize MinIO client and create bucket if needed."""
+        """Initialize MinIO client."""
+        # One pool sized for concurrent requests instead of MinIO's default of 10 connections
+        http_client = urllib3.PoolManager(
+            num_pools=8,
+            maxsize=CONFIG.MINIO_MAX_CONNECTIONS,
+            block=False,
+            timeout=urllib3.Timeout(connect=2, read=30),
+            retries=urllib3.Retry(total=3, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504]),
+            cert_reqs="CERT_REQUIRED",
+            ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where()
+        )
+        self.client = Minio(
+            CONFIG.MINIO_ENDPOINT,
+            access_key=CONFIG.MINIO_ACCESS_KEY,
+            secret_key=CONFIG.MINIO_SECRET_KEY,
+            secure=CONFIG.MINIO_SECURE,
+            http_client=http_client
+        )
+        self.bucket_name = CONFIG.MINIO_BUCKET_NAME
+        self._bucket_verified = False
+        logger.info("MinIO client initialized")
+
+    def initialize(self) -> None:
+        """Create the bucket if needed; runs at startup and again after the bucket is found missing."""
+        if self._bucket_verified:
+            return
         try:
-            self.client = Minio(
-                CONFIG.MINIO_ENDPOINT,
-                access_key=CONFIG.MINIO_ACCESS_KEY,
-                secret_key=CONFIG.MINIO_SECRET_KEY,
-                secure=CONFIG.MINIO_SECURE
-            )
-            self.bucket_name = CONFIG.MINIO_BUCKET_NAME
             if not self.client.bucket_exists(self.bucket_name):
                 self.client.make_bucket(self.bucket_name)
                 logger.info(f"Created MinIO bucket: {self.bucket_name}")
-            logger.info("MinIO client initialized")
+            self._bucket_verified = True
         except S3Error as e:
             logger.error(f"MinIO initialization failed: {str(e)}")
             raise ValueError(f"MinIO initialization failed: {str(e)}")
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
-    def upload_file(self, object_name: str, file_content: bytes, content_type: str) -> None:
-        """Upload file to MinIO bucket."""
+    @retry()
+    def upload_file(self, object_name: str, file_stream: BinaryIO, content_type: str, length: Optional[int] = None) -> Tuple[int, str]:
+        """Stream file to MinIO bucket and return the uploaded size and SHA-256 hex digest."""
+        # Recreate the bucket if startup couldn't verify it or it has since been deleted
+        if not self._bucket_verified:
+            self.initialize()
+        file_stream.seek(0)
+        # Hash bytes as MinIO reads them, so the payload is only traversed once
+        reader = HashingReader(file_stream)
         try:
+            # Objects larger than one part (or of unknown length) go up as a multipart upload
             self.client.put_object(
                 self.bucket_name,
                 object_name,
-                io.BytesIO(file_content),
-                length=len(file_content),
+                reader,
+                length=length if length is not None else -1,
+                part_size=CONFIG.UPLOAD_PART_SIZE,
                 content_type=content_type
             )
-            logger.debug(f"Uploaded file to MinIO: {object_name}")
         except S3Error as e:
-            logger.error(f"MinIO upload failed for {object_name}: {str(e)}")
-            raise ValueError(f"MinIO upload failed: {str(e)}")
+            if e.code == "NoSuchBucket":
+                # Let the retry recreate the bucket before the next attempt
+                self._bucket_verified = False
+            raise
+        logger.debug(f"Uploaded file to MinIO: {object_name}")
+        return reader.size, reader.sha256.hexdigest()
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
-    def get_file(self, object_name: str) -> Any:
-        """Retrieve file from MinIO bucket."""
+    @retry()
+    def get_file(self, object_name: str) -> Tuple[Any, int]:
+        """Retrieve file stream and size from MinIO bucket; raises FileNotFoundError for missing objects."""
         try:
             response = self.client.get_object(self.bucket_name, object_name)
             logger.debug(f"Retrieved file from MinIO: {object_name}")
-            return response
+            return response, int(response.headers["Content-Length"])
         except S3Error as e:
-            logger.error(f"MinIO download failed for {object_name}: {str(e)}")
-            raise ValueError(f"MinIO download failed: {str(e)}")
+            if e.code == "NoSuchKey":
+                logger.warning(f"File not found in MinIO: {object_name}")
+                raise FileNotFoundError(object_name)
+            raise
 
     def file_exists(self, object_name: str) -> bool:
         """Check if file exists in MinIO bucket."""
@@ -80,10 +155,19 @@ class MinIOClient(StorageClient):
         except S3Error:
             return False
 
+    @retry()
+    def delete_file(self, object_name: str) -> None:
+        """Remove a file from MinIO bucket; removing a missing object is not an error."""
+        self.client.remove_object(self.bucket_name, object_name)
+        logger.debug(f"Deleted file from MinIO: {object_name}")
+
     def check_health(self) -> dict:
         """Check MinIO bucket accessibility."""
         try:
-            self.client.bucket_exists(self.bucket_name)
+            if not self.client.bucket_exists(self.bucket_name):
+                self._bucket_verified = False
+                logger.error(f"MinIO bucket missing: {self.bucket_name}")
+                return {"status": CONFIG.UNHEALTHY, "error": f"Bucket {self.bucket_name} does not exist"}
             logger.debug("MinIO health check passed")
             return {"status": CONFIG.HEALTHY}
         except S3Error as e:
@@ -98,41 +182,62 @@ class LocalStorageClient(StorageClient):
         try:
             self.storage_path = CONFIG.LOCAL_STORAGE_PATH
             os.makedirs(self.storage_path, exist_ok=True)
+            # Resolved once; object paths are built from this prefix instead of re-joining per call
+            self._root = os.path.realpath(self.storage_path)
+            self._prefix = self._root + os.sep
             logger.info("Local storage client initialized")
         except OSError as e:
             logger.error(f"Local storage initialization failed: {str(e)}")
             raise ValueError(f"Local storage initialization failed: {str(e)}")
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
-    def upload_file(self, object_name: str, file_content: bytes, content_type: str) -> None:
-        """Save file to local storage."""
-        try:
-            file_path = os.path.join(self.storage_path, object_name)
-            with open(file_path, 'wb') as f:
-                f.write(file_content)
-            logger.debug(f"Uploaded file to local storage: {object_name}")
-        except OSError as e:
-            logger.error(f"Local storage upload failed for {object_name}: {str(e)}")
-            raise ValueError(f"Local storage upload failed: {str(e)}")
+    def _resolve_path(self, object_name: str) -> str:
+        """Return the absolute path of an object, rejecting names that escape the storage directory."""
+        # Object names are server-generated, so a lexical check is enough and needs no per-component lstat
+        file_path = os.path.normpath(self._prefix + object_name)
+        if not file_path.startswith(self._prefix):
+            logger.warning(f"Rejected object name outside local storage: {object_name}")
+            raise ValueError(f"Invalid object name: {object_name}")
+        return file_path
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
-    def get_file(self, object_name: str) -> Any:
-        """Retrieve file from local storage."""
-        try:
-            file_path = os.path.join(self.storage_path, object_name)
-            if not os.path.exists(file_path):
-                logger.warning(f"File not found in local storage: {object_name}")
-                raise ValueError("File not found")
-            logger.debug(f"Retrieved file from local storage: {object_name}")
-            return open(file_path, 'rb')
-        except OSError as e:
-            logger.error(f"Local storage download failed for {object_name}: {str(e)}")
-            raise ValueError(f"Local storage download failed: {str(e)}")
+    @retry()
+    def upload_file(self, object_name: str, file_stream: BinaryIO, content_type: str, length: Optional[int] = None) -> Tuple[int, str]:
+        """Stream file to local storage and return the written size and SHA-256 hex digest."""
+        file_path = self._resolve_path(object_name)
+        # Object names carry a shard prefix directory ("ab/...")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        file_stream.seek(0)
+        reader = HashingReader(file_stream)
+        with open(file_path, 'wb') as f:
+            shutil.copyfileobj(reader, f, CONFIG.UPLOAD_CHUNK_SIZE)
+        logger.debug(f"Uploaded file to local storage: {object_name}")
+        return reader.size, reader.sha256.hexdigest()
+
+    @retry()
+    def get_file(self, object_name: str) -> Tuple[Any, int]:
+        """Retrieve file stream and size from local storage; raises FileNotFoundError for missing files."""
+        f = open(self._resolve_path(object_name), 'rb')
+        logger.debug(f"Retrieved file from local storage: {object_name}")
+        return f, os.fstat(f.fileno()).st_size
+
+    def get_path(self, object_name: str) -> str:
+        """Return the filesystem path of a stored file."""
+        return self._resolve_path(object_name)
 
     def file_exists(self, object_name: str) -> bool:
         """Check if file exists in local storage."""
-        file_path = os.path.join(self.storage_path, object_name)
-        return os.path.exists(file_path)
+        try:
+            os.stat(self._resolve_path(object_name))
+            return True
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def delete_file(self, object_name: str) -> None:
+        """Remove a file from local storage; removing a missing file is not an error."""
+        try:
+            os.remove(self._resolve_path(object_name))
+            logger.debug(f"Deleted file from local storage: {object_name}")
+        except FileNotFoundError:
+            pass
 
     def check_health(self) -> dict:
         """Check local storage directory accessibility."""